@@ -2,23 +2,43 @@
 https://en.wikipedia.org/wiki/B%2B_tree
 '''
 import math
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from operator import itemgetter
 
 
 class Node:
     '''
     Node abstraction. Represents a single bucket
     '''
+    # a tree has one node object per bucket, so keep them small: fixed attribute slots instead of a __dict__ per node
+    __slots__ = ('b', 'values', 'ptrs', 'left_sibling', 'right_sibling', 'parent', 'is_leaf')
 
-    def __init__(self, b, values=[], ptrs=[], \
+    def __init__(self, b, values=None, ptrs=None, \
                  left_sibling=None, right_sibling=None, parent=None, is_leaf=False):
         self.b = b  # branching factor
-        self.values = values  # Values (the data from the pk column)
-        self.ptrs = ptrs  # ptrs (the indexes of each datapoint or the index of another bucket)
+        # every node gets its own lists (a mutable default would be shared by all nodes created without them)
+        self.values = values if values is not None else []  # Values (the data from the pk column)
+        # ptrs (the indexes of each datapoint or the index of another bucket). They are all integers, so they are
+        # stored in a typed array of 8 byte ints (array('q')) instead of a list of int objects
+        self.ptrs = ptrs if ptrs is not None else array('q')
         self.left_sibling = left_sibling  # the index of a buckets left sibling
         self.right_sibling = right_sibling  # the index of a buckets right sibling
         self.parent = parent  # the index of a buckets parent
         self.is_leaf = is_leaf  # a boolean value signaling whether the node is a leaf or not
 
+    def __getstate__(self):
+        # pickle the node as a dict of its attributes (the same state nodes had before __slots__)
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def __setstate__(self, state):
+        # works for indexes pickled both before and after nodes used __slots__ (and stored their ptrs in a list)
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        if not isinstance(self.ptrs, array):
+            self.ptrs = array('q', self.ptrs)
+
     def find(self, value, return_ops=False):
         '''
         Returns the index of the next node to search for a value if the node is not a leaf (a ptrs of the available ones).
@@ -27,24 +47,19 @@ class Node:
         value: the value that we are searching for
         return_ops: set to True if you want to use the number of operations (for benchmarking)
         '''
-        ops = 0  # number of operations (<>= etc). Used for benchmarking
         if self.is_leaf:  #
             return
 
-        # for each value in the node, if the user supplied value is smaller, return the btrees value index
-        # else (no value in the node is larger) return the last ptr
-        for index, existing_val in enumerate(self.values):
-            ops += 1
-            if value < existing_val:
-                if return_ops:
-                    return self.ptrs[index], ops
-                else:
-                    return self.ptrs[index]
+        # binary search for the first value in the node that is larger than the user supplied value and return its ptr
+        # if no value in the node is larger, the index is len(values), i.e. the last ptr
+        index = bisect_right(self.values, value)
+        # a binary search over n values needs at most n.bit_length() comparisons
+        ops = len(self.values).bit_length()  # number of operations (<>= etc). Used for benchmarking
 
         if return_ops:
-            return self.ptrs[-1], ops
+            return self.ptrs[index], ops
         else:
-            return self.ptrs[-1]
+            return self.ptrs[index]
 
     def insert(self, value, ptr, ptr1=None):
         '''
@@ -56,62 +71,379 @@ class Node:
         ptr1: the 2nd ptr (in case the user wants to insert into a nonleaf node for ex)
 
         '''
-        # for each value in the node, if the user supplied value is smaller, insert the value and its ptr into that position
+        # binary search for the first value in the node that is larger than the user supplied value and
+        # insert the value and its ptr into that position (if no value is larger, this is the back of the list).
+        # in a leaf every ptr sits next to its value, in a non leaf node the new ptr is the right child of the value
         # if a second ptr is provided, insert it right next to the 1st ptr
-        # else (no value in the node is larger) append value and ptr/s to the back of the list.
-
-        for index, existing_val in enumerate(self.values):
-            if value < existing_val:
-
-                self.values.insert(index, value)
-                self.ptrs.insert(index + 1, ptr)
-
-                if ptr1:
-                    self.ptrs.insert(index + 1, ptr1)
-                return
-        self.values.append(value)
-        self.ptrs.append(ptr)
-        if ptr1:
-            self.ptrs.append(ptr1)
+        index = bisect_right(self.values, value)
+
+        self.values.insert(index, value)
+        if self.is_leaf:
+            self.ptrs.insert(index, ptr)
+        elif ptr1 is not None:
+            # both ptrs go in with a single slice assignment (one shift of the tail instead of two)
+            self.ptrs[index + 1:index + 1] = array('q', (ptr1, ptr))
+        else:
+            self.ptrs.insert(index + 1, ptr)
 
     def show(self):
         '''
         print the node's value and important info
         '''
         print('Values', self.values)
-        print('ptrs', self.ptrs)
+        print('ptrs', list(self.ptrs))
         print('Parent', self.parent)
         print('LS', self.left_sibling)
         print('RS', self.right_sibling)
 
 
 class Btree:
-    def __init__(self, b):
+    # the range operators supported by find. For each: the sibling to follow (all values are larger to the right and
+    # smaller to the left) and the binary search that returns where the matches start (right_sibling) or end (left_sibling)
+    # in a sorted list of values
+    _RANGE_OPS = {'>': ('right_sibling', bisect_right),
+                  '>=': ('right_sibling', bisect_left),
+                  '<': ('left_sibling', bisect_left),
+                  '<=': ('left_sibling', bisect_right)}
+
+    def __init__(self, b, buffer_size=0):
         '''
         The tree abstraction.
+
+        b: the branching factor
+        buffer_size: if > 0, inserts are collected in a sorted buffer and added to the tree together,
+                     once buffer_size of them are pending (see insert). Def: 0 (insert directly)
         '''
         self.b = b  # branching factor
         self.nodes = []  # list of nodes. Every new node is appended here
         self.root = None  # the index of the root node
+        # the values/ptrs of all leaves, left to right, as two flat lists (see _build_leaf_chain).
+        # None when the tree has been modified since they were last built
+        self.leaf_values = None
+        self.leaf_ptrs = None
+        # the index of the rightmost leaf. Values larger than its first value always belong to it,
+        # so ascending inserts (autoincrement keys etc) go straight there. None if unknown
+        self._rightmost_leaf = None
+        # pending inserts (values sorted, ptrs next to their values) and the number that triggers adding them to the tree
+        self.buffer_size = buffer_size
+        self._buffer_values = []
+        self._buffer_ptrs = []
+
+    def __getstate__(self):
+        # the flat leaf lists repeat every value and ptr of the leaves, so they are not pickled with the tree.
+        # only whether they were built is, __setstate__ builds them again
+        state = self.__dict__.copy()
+        state['_leaf_chain'] = state.pop('leaf_values') is not None
+        del state['leaf_ptrs']
+        return state
+
+    def __setstate__(self, state):
+        # indexes pickled by an older version lack the attributes added since, start from the defaults of a new tree
+        leaf_chain = state.pop('_leaf_chain', False)
+        self.__init__(state['b'])
+        self.__dict__.update(state)
+        if leaf_chain:
+            self._build_leaf_chain()
 
     def insert(self, value, ptr, rptr=None):
         '''
         Insert the value and its ptr/s to the appropriate node (node-level insertion is covered by the node object).
         User can input two ptrs to insert to a non leaf node.
+        If the tree has an insert buffer, the value is only added to the buffer (find still returns it)
+        and the whole buffer is added to the tree in ascending order once it is full.
+        '''
+        if self.buffer_size > 0:
+            index = bisect_right(self._buffer_values, value)
+            self._buffer_values.insert(index, value)
+            self._buffer_ptrs.insert(index, ptr)
+            if len(self._buffer_values) >= self.buffer_size:
+                self._flush_buffer()
+            return
+
+        self._insert(value, ptr)
+
+    def _flush_buffer(self):
+        '''
+        Merge all pending inserts of the buffer into the tree. An empty tree is bulk loaded from them.
+        Otherwise the leaves are visited once, left to right: each run of buffered values that belongs to the same leaf
+        is spliced into it, and only after all runs are in, every overfull leaf is split (once, into as many leaves as
+        needed). The parent levels then receive one entry per new leaf, and split as usual.
+        '''
+        values, ptrs = self._buffer_values, self._buffer_ptrs
+        self._buffer_values = []
+        self._buffer_ptrs = []
+        if not values:
+            return
+        if self.root is None:
+            self.bulk_load(zip(values, ptrs))
+            return
+
+        # the flat leaf lists no longer match the leaves
+        self.leaf_values = self.leaf_ptrs = None
+
+        nodes = self.nodes
+        overfull = []
+        start = 0
+        while start < len(values):
+            # descend to the leaf of the first value of the run. Its upper bound is the closest separator
+            # right of the path (None for the rightmost leaf)
+            value = values[start]
+            upper = None
+            idx = self.root
+            node = nodes[idx]
+            while not node.is_leaf:
+                slot = bisect_right(node.values, value)
+                if slot < len(node.values):
+                    upper = node.values[slot]
+                idx = node.ptrs[slot]
+                node = nodes[idx]
+
+            # all buffered values below the upper bound of the leaf belong to it
+            end = len(values) if upper is None else bisect_left(values, upper, start)
+            node_values = node.values
+            if node_values and value < node_values[-1] and end - start <= len(node_values):
+                # a short run: put each value in place (a binary search and a shift of the tail, both in C)
+                node_ptrs = node.ptrs
+                for i in range(start, end):
+                    pos = bisect_right(node_values, values[i])
+                    node_values.insert(pos, values[i])
+                    node_ptrs.insert(pos, ptrs[i])
+            elif node_values and value < node_values[-1]:
+                # merge the two sorted runs (sort is stable, so equal values from the buffer go after the existing)
+                pairs = list(zip(node.values, node.ptrs))
+                pairs.extend(zip(values[start:end], ptrs[start:end]))
+                pairs.sort(key=itemgetter(0))
+                node.values = [value for value, _ in pairs]
+                node.ptrs = array('q', (ptr for _, ptr in pairs))
+            else:
+                # the whole run goes after the values of the leaf (ascending inserts)
+                node.values.extend(values[start:end])
+                node.ptrs.extend(ptrs[start:end])
+            if len(node.values) >= self.b:
+                overfull.append(idx)
+            start = end
+
+        for idx in overfull:
+            if len(nodes[idx].values) == self.b:
+                # a single value too many, a regular split does
+                self.split(idx)
+            else:
+                self._split_leaf(idx)
+
+    def _split_leaf(self, node_id):
+        '''
+        Split the leaf with index=node_id into as many leaves as needed so that none has more than b-1 values
+        (evenly sized, as in bulk_load) and add the new ones to the parent level.
+        '''
+        node = self.nodes[node_id]
+        chunks = list(self._chunks(list(zip(node.values, node.ptrs)), self.b - 1))
+        node.values = [value for value, _ in chunks[0]]
+        node.ptrs = array('q', (ptr for _, ptr in chunks[0]))
+
+        left_id = node_id
+        for chunk in chunks[1:]:
+            left = self.nodes[left_id]
+            right_id = len(self.nodes)
+            self.nodes.append(Node(self.b, [value for value, _ in chunk], array('q', (ptr for _, ptr in chunk)),
+                                   left_sibling=left_id, right_sibling=left.right_sibling, is_leaf=True))
+            if left.right_sibling is not None:
+                self.nodes[left.right_sibling].left_sibling = right_id
+            elif left_id == self._rightmost_leaf:
+                self._rightmost_leaf = right_id
+            left.right_sibling = right_id
+            # the first value of the new leaf separates it from the previous one (the same value a split would propagate)
+            self._insert_in_parent(left_id, chunk[0][0], right_id)
+            left_id = right_id
+
+    def _insert(self, value, ptr):
+        '''
+        Insert the value and its ptr to the tree (insert without the buffer).
         '''
         # if the tree is empty, add the first node and set the root index to 0 (the only node's index)
         if self.root is None:
             self.nodes.append(Node(self.b, is_leaf=True))
             self.root = 0
+            self._rightmost_leaf = 0
 
-        # find the index of the node that the value and its ptr/s should be inserted to (_search)
-        index = self._search(value)
+        # the flat leaf lists no longer match the leaves
+        self.leaf_values = self.leaf_ptrs = None
+
+        # find the index of the node that the value and its ptr/s should be inserted to.
+        # if it is not smaller than the first value of the rightmost leaf, that is the node, no need to search
+        rightmost = self._rightmost_leaf
+        if rightmost is not None and self.nodes[rightmost].values and value >= self.nodes[rightmost].values[0]:
+            index = rightmost
+        else:
+            index = self._search(value)
         # insert to it
         self.nodes[index].insert(value, ptr)
         # if the node has more elements than b-1, split the node
         if len(self.nodes[index].values) == self.b:
             self.split(index)
 
+    def bulk_load(self, items, fill_factor=1.0):
+        '''
+        Build the tree bottom up from (value, ptr) pairs instead of inserting them one by one.
+        The items are sorted, leaves are filled left to right and every level above is built from the
+        smallest value of each node of the level below, until a single root remains.
+        If the tree is not empty, the items are inserted one by one instead.
+
+        items: iterable of (value, ptr) pairs (for example (pk value, row index))
+        fill_factor: the fraction (0-1] of each node that is filled. Leaves some room for later inserts if < 1.
+        '''
+        if self.root is not None:
+            for value, ptr in items:
+                self._insert(value, ptr)
+            return
+
+        items = sorted(items, key=lambda item: item[0])
+        if not items:
+            return
+
+        # a leaf holds at most b-1 values and a non leaf node at most b ptrs (b values/b+1 ptrs is what makes split fire,
+        # so a node must never be built with more). A non leaf node gets at least 3 ptrs when b allows it,
+        # so that the even chunks of a level never leave a node with a single child
+        leaf_size = max(1, min(self.b - 1, math.ceil(fill_factor * (self.b - 1))))
+        fanout = min(self.b, max(3, math.ceil(fill_factor * self.b)))
+
+        # leaves: consecutive chunks of the sorted items, linked through their siblings.
+        # level holds the (index, smallest value) of every node of the level that was just built
+        level = []
+        for chunk in self._chunks(items, leaf_size):
+            idx = len(self.nodes)
+            left_sibling = idx - 1 if level else None
+            if left_sibling is not None:
+                self.nodes[left_sibling].right_sibling = idx
+            self.nodes.append(Node(self.b, [value for value, _ in chunk], array('q', (ptr for _, ptr in chunk)),
+                                   left_sibling=left_sibling, is_leaf=True))
+            level.append((idx, chunk[0][0]))
+
+        # non leaf levels: each node points to a chunk of the level below and is separated
+        # by the smallest value of every child but the first (the same value a split would propagate)
+        while len(level) > 1:
+            upper = []
+            for chunk in self._chunks(level, fanout):
+                idx = len(self.nodes)
+                for child, _ in chunk:
+                    self.nodes[child].parent = idx
+                self.nodes.append(Node(self.b, [value for _, value in chunk[1:]],
+                                       array('q', (child for child, _ in chunk))))
+                upper.append((idx, chunk[0][1]))
+            level = upper
+
+        self.root = level[0][0]
+        # the nodes were appended level by level (leaves first), lay them out for searching
+        self.compact()
+
+    @staticmethod
+    def _chunks(lst, size):
+        '''
+        Split lst into the least number of consecutive chunks with at most size elements each.
+        Chunk lengths differ by at most one, so the last chunk is never left almost empty.
+        '''
+        no_of_chunks = math.ceil(len(lst) / size)
+        small, extra = divmod(len(lst), no_of_chunks)
+        start = 0
+        for i in range(no_of_chunks):
+            end = start + small + (1 if i < extra else 0)
+            yield lst[start:end]
+            start = end
+
+    def compact(self):
+        '''
+        Rewrite the nodes list in van Emde Boas order and renumber all node indexes accordingly.
+        The tree is cut at half its height, the top half is placed first and every bottom subtree follows it
+        (each laid out the same way, recursively). A root to leaf path then stays within a few neighbouring
+        runs of nodes at every granularity. Nodes that are no longer reachable from the root are dropped.
+        '''
+        if self.root is None:
+            return
+
+        # all leaves are at the same depth, so the height is the length of any root to leaf path
+        height = 1
+        node = self.nodes[self.root]
+        while not node.is_leaf:
+            node = self.nodes[node.ptrs[0]]
+            height += 1
+
+        order = self._veb_order(self.root, height)
+        new_idx = {old: new for new, old in enumerate(order)}
+
+        def remap(idx):
+            return None if idx is None else new_idx[idx]
+
+        # create new node objects in the new order as well, so that they are also allocated close to each other
+        nodes = []
+        for old in order:
+            node = self.nodes[old]
+            ptrs = array('q', node.ptrs) if node.is_leaf else array('q', (new_idx[ptr] for ptr in node.ptrs))
+            nodes.append(Node(self.b, list(node.values), ptrs, left_sibling=remap(node.left_sibling),
+                              right_sibling=remap(node.right_sibling), parent=remap(node.parent),
+                              is_leaf=node.is_leaf))
+        self.nodes = nodes
+        self.root = new_idx[self.root]
+
+        idx = self.root
+        while not self.nodes[idx].is_leaf:
+            idx = self.nodes[idx].ptrs[-1]
+        self._rightmost_leaf = idx
+        self._build_leaf_chain()
+
+    def _build_leaf_chain(self):
+        '''
+        Concatenate the values and ptrs of all leaves (left to right, following the right siblings) into two flat lists.
+        The values are sorted, so a range query on them is a binary search and a slice instead of a walk over the leaves.
+        Built by compact (and thus bulk_load) and when an unpickled tree had them, dropped by any insert/delete.
+        '''
+        values = []
+        self.leaf_ptrs = array('q')
+        if self.root is not None:
+            # start from the leftmost leaf
+            idx = self.root
+            while not self.nodes[idx].is_leaf:
+                idx = self.nodes[idx].ptrs[0]
+            while idx is not None:
+                node = self.nodes[idx]
+                values.extend(node.values)
+                self.leaf_ptrs.extend(node.ptrs)
+                idx = node.right_sibling
+
+        self.leaf_values = self._typed_values(values)
+
+    @staticmethod
+    def _typed_values(values):
+        '''
+        Return the (sorted) values as a typed array of the smallest machine integer that fits them,
+        if they are all ints (the usual primary key). An int object takes 28 bytes and a list slot another 8,
+        an array item 4 or 8. Any other values (str etc) are returned as they are.
+        '''
+        if not values or any(type(value) is not int for value in values):
+            return values
+        for typecode in ('i', 'q'):
+            limit = 2 ** (array(typecode).itemsize * 8 - 1)
+            if -limit <= values[0] and values[-1] < limit:
+                return array(typecode, values)
+        return values
+
+    def _veb_order(self, idx, height):
+        '''
+        Return the indexes of the subtree of height levels rooted at idx, in van Emde Boas order.
+        '''
+        if height == 1:
+            return [idx]
+
+        top_height = height // 2
+        order = self._veb_order(idx, top_height)
+
+        # the roots of the bottom subtrees are the children of the deepest level of the top subtree
+        bottom_roots = [idx]
+        for _ in range(top_height):
+            bottom_roots = [child for ptr in bottom_roots for child in self.nodes[ptr].ptrs]
+
+        for child in bottom_roots:
+            order.extend(self._veb_order(child, height - top_height))
+        return order
+
     def _search(self, value, return_ops=False):
         '''
         Returns the index of the node that the given value exist or should exist in.
@@ -121,20 +453,25 @@ class Btree:
         '''
         ops = 0  # number of operations (<>= etc). Used for benchmarking
 
-        # start with the root node
-        node = self.nodes[self.root]
+        # start with the root node. The index of a node in the nodes list is its id,
+        # so we carry the index along while descending instead of looking the node up afterwards
+        nodes = self.nodes
+        idx = self.root
+        node = nodes[idx]
         # while the node that we are searching in is not a leaf
-        # keep searching
+        # keep searching. This is the hot path of every insert and find, so the work of node.find
+        # (binary search for the next ptr) is done inline instead of through a method call per level
         while not node.is_leaf:
-            idx, ops1 = node.find(value, return_ops=True)
-            node = self.nodes[idx]
-            ops += ops1
+            values = node.values
+            idx = node.ptrs[bisect_right(values, value)]
+            ops += len(values).bit_length()
+            node = nodes[idx]
 
         # finally return the index of the appropriate node (and the ops if you want to)
         if return_ops:
-            return self.nodes.index(node), ops
+            return idx, ops
         else:
-            return self.nodes.index(node)
+            return idx
 
     def split(self, node_id):
         '''
@@ -143,12 +480,15 @@ class Btree:
         # fetch the node to be split
         node = self.nodes[node_id]
         # the value that will be propagated to the parent is the middle one.
-        new_parent_value = node.values[len(node.values) // 2]
+        mid = len(node.values) // 2
+        new_parent_value = node.values[mid]
         if node.is_leaf:
             # if the node is a leaf, the parent value should be a part of the new node (right)
             # Important: in a b+tree, every value should appear in a leaf
-            right_values = node.values[len(node.values) // 2:]
-            right_ptrs = node.ptrs[len(node.ptrs) // 2:]
+            # (a leaf has a ptr per value, so both are split at mid)
+            right_values = node.values[mid:]
+            right_ptrs = node.ptrs[mid:]
+            left_ptrs = mid
 
             # create the new node with the right half of the old nodes values and ptrs (including the middle ones)
             right = Node(self.b, right_values, right_ptrs, \
@@ -159,14 +499,15 @@ class Btree:
             # Thus we set the old nodes (now left) right sibling to the right nodes future index (len of nodes)
             if node.right_sibling is not None:
                 self.nodes[node.right_sibling].left_sibling = len(self.nodes)
+            elif node_id == self._rightmost_leaf:
+                self._rightmost_leaf = len(self.nodes)
             node.right_sibling = len(self.nodes)
         else:
             # if the node is not a leaf, the parent value shoudl NOT be part of the new node
-            right_values = node.values[len(node.values) // 2 + 1:]
-            if self.b % 2 == 1:
-                right_ptrs = node.ptrs[len(node.ptrs) // 2:]
-            else:
-                right_ptrs = node.ptrs[len(node.ptrs) // 2 + 1:]
+            # (a non leaf node has one more ptr than values, the ptrs left and right of the middle value go to left and right)
+            right_values = node.values[mid + 1:]
+            right_ptrs = node.ptrs[mid + 1:]
+            left_ptrs = mid + 1
 
             # if nonleafs should be connected change the following two lines and add siblings
             right = Node(self.b, right_values, right_ptrs, \
@@ -178,20 +519,26 @@ class Btree:
                 self.nodes[ptr].parent = len(self.nodes)
 
         # old node (left) keeps only the first half of the values/ptrs
-        node.values = node.values[:len(node.values) // 2]
-        if self.b % 2 == 1:
-            node.ptrs = node.ptrs[:len(node.ptrs) // 2]
-        else:
-            node.ptrs = node.ptrs[:len(node.ptrs) // 2 + 1]
+        # (truncate the lists in place instead of copying the first half into new lists)
+        del node.values[mid:]
+        del node.ptrs[left_ptrs:]
 
         # append the new node (right) to the nodes list
         self.nodes.append(right)
+        self._insert_in_parent(node_id, new_parent_value, len(self.nodes) - 1)
 
+    def _insert_in_parent(self, node_id, value, right_id):
+        '''
+        Add the node with index=right_id to the parent of node with index=node_id, right after it, separated by value.
+        If that node is the root, a new root is added above the two.
+        '''
+        node = self.nodes[node_id]
+        right = self.nodes[right_id]
         # If the new nodes have no parents (a new level needs to be added
         if node.parent is None:
             # its the root that is split
             # new root contains the parent value and ptrs to the two recently split nodes
-            parent = Node(self.b, [new_parent_value], [node_id, len(self.nodes) - 1] \
+            parent = Node(self.b, [value], array('q', (node_id, right_id)) \
                           , parent=node.parent, is_leaf=False)
 
             # set root, and parent of split celss to the index of the new root node (len of nodes-1)
@@ -201,193 +548,182 @@ class Btree:
             right.parent = len(self.nodes) - 1
         else:
             # insert the parent value to the parent
-
-            self.nodes[node.parent].insert(new_parent_value, len(self.nodes) - 1)
+            right.parent = node.parent
+            self.nodes[node.parent].insert(value, right_id)
             # check whether the parent needs to be split
             if len(self.nodes[node.parent].values) == self.b:
                 self.split(node.parent)
 
-    # Delete a node
+    def _search_path(self, value):
+        '''
+        Same descent as _search, but also returns the path that was followed: a list with a
+        (node index, child slot) pair for every non leaf node visited, root first.
+        The child slot is the position of the next node in the ptrs of that node.
+
+        value: the value that we are searching for
+        '''
+        path = []
+        nodes = self.nodes
+        idx = self.root
+        node = nodes[idx]
+        while not node.is_leaf:
+            slot = bisect_right(node.values, value)
+            path.append((idx, slot))
+            idx = node.ptrs[slot]
+            node = nodes[idx]
+        return idx, path
+
     def delete(self, value, ptr):
-        node_ = self.nodes[self._search(value)]
-
-        temp = 0
-        for i, item in enumerate(node_.values):
-            if item == value:
-                temp = 1
-
-                if ptr == node_.ptrs[i]:
-                    if len(node_.ptrs) > 1:
-                        node_.ptrs.pop(node_.ptrs.index(ptr))
-                    elif node_ == self.root:
-                        node_.values.pop(i)
-                        node_.ptrs.pop(i)
-                    else:
-                        node_.ptrs.pop(node_.ptrs.index(ptr))
-                        del node_.ptrs[i]
-                        node_.values.pop(node_.values.index(value))
-                        self.deleteEntry(node_, value, ptr)
-                else:
-                    print("Value not in ptr")
-                    return
-        if temp == 0:
+        '''
+        Delete the value with the given ptr from the tree.
+
+        value: the value that we are deleting
+        ptr: the ptr of the deleted value (its index for example)
+        '''
+        # pending inserts are added to the tree first, the value might be one of them
+        if self._buffer_values:
+            self._flush_buffer()
+
+        if self.root is None:
             print("Value not in Tree")
             return
 
-    # Delete an entry
-    def deleteEntry(self, node_, value, ptr):
-
-        if not node_.check_leaf:
-            for i, item in enumerate(node_.ptrs):
-                if item == ptr:
-                    node_.ptrs.pop(i)
-                    break
-            for i, item in enumerate(node_.values):
-                if item == value:
-                    node_.values.pop(i)
-                    break
-
-        if self.root == node_ and len(node_.ptrs) == 1:
-            self.root = node_.ptrs[0]
-            node_.ptrs[0].parent = None
-            del node_
+        # find the leaf and remember the path to it, the parents are needed if the leaf underflows
+        leaf_idx, path = self._search_path(value)
+        node_ = self.nodes[leaf_idx]
+
+        i = bisect_left(node_.values, value)
+        if i == len(node_.values) or node_.values[i] != value:
+            print("Value not in Tree")
+            return
+        # skip equal values that belong to other ptrs
+        while i < len(node_.values) and node_.values[i] == value and node_.ptrs[i] != ptr:
+            i += 1
+        if i == len(node_.values) or node_.values[i] != value:
+            print("Value not in ptr")
             return
-        elif (len(node_.ptrs) < int(math.ceil(node_.order / 2)) and node_.check_leaf == False) or (
-                len(node_.values) < int(math.ceil((node_.order - 1) / 2)) and node_.check_leaf == True):
-
-            is_predecessor = 0
-            parentNode = node_.parent
-            PrevNode = -1
-            NextNode = -1
-            PrevK = -1
-            PostK = -1
-            for i, item in enumerate(parentNode.ptrs):
-
-                if item == node_:
-                    if i > 0:
-                        PrevNode = parentNode.ptrs[i - 1]
-                        PrevK = parentNode.values[i - 1]
-
-                    if i < len(parentNode.ptrs) - 1:
-                        NextNode = parentNode.ptrs[i + 1]
-                        PostK = parentNode.values[i]
-
-            if PrevNode == -1:
-                ndash = NextNode
-                value_ = PostK
-            elif NextNode == -1:
-                is_predecessor = 1
-                ndash = PrevNode
-                value_ = PrevK
-            else:
-                if len(node_.values) + len(NextNode.values) < node_.order:
-                    ndash = NextNode
-                    value_ = PostK
-                else:
-                    is_predecessor = 1
-                    ndash = PrevNode
-                    value_ = PrevK
-
-            if len(node_.values) + len(ndash.values) < node_.order:
-                if is_predecessor == 0:
-                    node_, ndash = ndash, node_
-                ndash.ptrs += node_.ptrs
-                if not node_.check_leaf:
-                    ndash.values.append(value_)
-                else:
-                    ndash.nextptr = node_.nextptr
-                ndash.values += node_.values
 
-                if not ndash.check_leaf:
-                    for j in ndash.ptrs:
-                        j.parent = ndash
+        node_.values.pop(i)
+        node_.ptrs.pop(i)
+        self.leaf_values = self.leaf_ptrs = None
+        self.deleteEntry(leaf_idx, path)
+
+    def deleteEntry(self, node_idx, path):
+        '''
+        Restore the minimum occupancy of the tree after an entry was removed from node with index=node_idx.
+        Walks up the path (as returned by _search_path) one level per iteration: an underfull node borrows from
+        or is merged with a sibling, and a merge removes an entry from the parent, which is handled next.
+        Merged away nodes are left unreferenced in the nodes list (compact() drops them).
 
-                self.deleteEntry(node_.parent, value_, node_)
-                del node_
+        node_idx: the index of the node an entry was removed from
+        path: the (node index, child slot) pairs of its ancestors, root first
+        '''
+        nodes = self.nodes
+        min_values = math.ceil((self.b - 1) / 2)  # minimum number of values in a leaf
+        min_ptrs = math.ceil(self.b / 2)  # minimum number of ptrs in a non leaf node
+
+        while path:
+            node = nodes[node_idx]
+            if node.is_leaf and len(node.values) >= min_values or \
+                    not node.is_leaf and len(node.ptrs) >= min_ptrs:
+                break
+
+            parent_idx, slot = path.pop()
+            parent = nodes[parent_idx]
+            # use the left sibling if there is one (under the same parent), else the right one.
+            # sep is the index of the parent value that separates the two nodes
+            if slot > 0:
+                sep = slot - 1
+                left_idx, right_idx = parent.ptrs[sep], node_idx
             else:
-                if is_predecessor == 1:
-                    if not node_.check_leaf:
-                        ndashpm = ndash.ptrs.pop(-1)
-                        ndashkm_1 = ndash.values.pop(-1)
-                        node_.ptrs = [ndashpm] + node_.ptrs
-                        node_.values = [value_] + node_.values
-                        parentNode = node_.parent
-                        for i, item in enumerate(parentNode.values):
-                            if item == value_:
-                                p.values[i] = ndashkm_1
-                                break
+                sep = 0
+                left_idx, right_idx = node_idx, parent.ptrs[1]
+            left, right = nodes[left_idx], nodes[right_idx]
+
+            if node.is_leaf:
+                if len(left.values) + len(right.values) <= self.b - 1:
+                    # merge right into left and unlink right from the leaf level
+                    left.values.extend(right.values)
+                    left.ptrs.extend(right.ptrs)
+                    left.right_sibling = right.right_sibling
+                    if right.right_sibling is not None:
+                        nodes[right.right_sibling].left_sibling = left_idx
+                    elif right_idx == self._rightmost_leaf:
+                        self._rightmost_leaf = left_idx
+                    del parent.values[sep]
+                    del parent.ptrs[sep + 1]
+                else:
+                    # borrow a single entry from the sibling, the separator becomes the new first value of right
+                    if right_idx == node_idx:
+                        right.values.insert(0, left.values.pop())
+                        right.ptrs.insert(0, left.ptrs.pop())
                     else:
-                        ndashpm = ndash.ptrs.pop(-1)
-                        ndashkm = ndash.values.pop(-1)
-                        node_.ptrs = [ndashpm] + node_.ptrs
-                        node_.values = [ndashkm] + node_.values
-                        parentNode = node_.parent
-                        for i, item in enumerate(p.values):
-                            if item == value_:
-                                parentNode.values[i] = ndashkm
-                                break
+                        left.values.append(right.values.pop(0))
+                        left.ptrs.append(right.ptrs.pop(0))
+                    parent.values[sep] = right.values[0]
+            else:
+                if len(left.ptrs) + len(right.ptrs) <= self.b:
+                    # merge right into left, the separator moves down between them
+                    for child in right.ptrs:
+                        nodes[child].parent = left_idx
+                    left.values.append(parent.values[sep])
+                    left.values.extend(right.values)
+                    left.ptrs.extend(right.ptrs)
+                    del parent.values[sep]
+                    del parent.ptrs[sep + 1]
                 else:
-                    if not node_.check_leaf:
-                        ndashp0 = ndash.ptrs.pop(0)
-                        ndashk0 = ndash.values.pop(0)
-                        node_.ptrs = node_.ptrs + [ndashp0]
-                        node_.values = node_.values + [value_]
-                        parentNode = node_.parent
-                        for i, item in enumerate(parentNode.values):
-                            if item == value_:
-                                parentNode.values[i] = ndashk0
-                                break
+                    # rotate a single child through the parent
+                    if right_idx == node_idx:
+                        right.values.insert(0, parent.values[sep])
+                        right.ptrs.insert(0, left.ptrs.pop())
+                        parent.values[sep] = left.values.pop()
+                        nodes[right.ptrs[0]].parent = right_idx
                     else:
-                        ndashp0 = ndash.ptrs.pop(0)
-                        ndashk0 = ndash.values.pop(0)
-                        node_.ptrs = node_.ptrs + [ndashp0]
-                        node_.values = node_.values + [ndashk0]
-                        parentNode = node_.parent
-                        for i, item in enumerate(parentNode.values):
-                            if item == value_:
-                                parentNode.values[i] = ndash.values[0]
-                                break
-
-                if not ndash.check_leaf:
-                    for j in ndash.ptrs:
-                        j.parent = ndash
-                if not node_.check_leaf:
-                    for j in node_.ptrs:
-                        j.parent = node_
-                if not parentNode.check_leaf:
-                    for j in parentNode.ptrs:
-                        j.parent = parentNode
-    def show(self):
+                        left.values.append(parent.values[sep])
+                        left.ptrs.append(right.ptrs.pop(0))
+                        parent.values[sep] = right.values.pop(0)
+                        nodes[left.ptrs[-1]].parent = left_idx
+
+            node_idx = parent_idx
+
+        # if the root is left with a single child, that child becomes the new root
+        root = nodes[self.root]
+        if not root.is_leaf and len(root.ptrs) == 1:
+            self.root = root.ptrs[0]
+            nodes[self.root].parent = None
+
+    def _nodes_by_level(self):
         '''
-        Show important info for each node (sort the by level - root first, then left to right)
+        Return the indexes of all nodes, sorted by level (root first, then left to right), with a breadth first traversal.
         '''
         nds = []
-        nds.append(self.root)
-        for ptr in nds:
-            if self.nodes[ptr].is_leaf:
-                continue
-            nds.extend(self.nodes[ptr].ptrs)
+        queue = deque([self.root] if self.root is not None else [])
+        while queue:
+            ptr = queue.popleft()
+            nds.append(ptr)
+            if not self.nodes[ptr].is_leaf:
+                queue.extend(self.nodes[ptr].ptrs)
+        return nds
 
-        for ptr in nds:
+    def show(self):
+        '''
+        Show important info for each node (sort the by level - root first, then left to right)
+        '''
+        for ptr in self._nodes_by_level():
             print(f'## {ptr} ##')
             self.nodes[ptr].show()
             print('----')
 
     def plot(self):
         ## arrange the nodes top to bottom left to right
-        nds = []
-        nds.append(self.root)
-        for ptr in nds:
-            if self.nodes[ptr].is_leaf:
-                continue
-            nds.extend(self.nodes[ptr].ptrs)
+        nds = self._nodes_by_level()
 
-        # add each node and each link
-        g = 'digraph G{\nforcelabels=true;\n'
+        # add each node and each link (collect the lines and join them once, instead of growing a string)
+        g = ['digraph G{\nforcelabels=true;\n']
 
         for i in nds:
             node = self.nodes[i]
-            g += f'{i} [label="{node.values}"]\n'
+            g.append(f'{i} [label="{node.values}"]\n')
             if node.is_leaf:
                 continue
                 # if node.left_sibling is not None:
@@ -398,9 +734,10 @@ class Btree:
                 # g+=f'"{node.values}"->"{self.nodes[node.parent].values}" [color="red" constraint=false];\n'
             else:
                 for child in node.ptrs:
-                    g += f'{child} [label="{self.nodes[child].values}"]\n'
-                    g += f'{i}->{child};\n'
-        g += "}"
+                    g.append(f'{child} [label="{self.nodes[child].values}"]\n')
+                    g.append(f'{i}->{child};\n')
+        g.append("}")
+        g = ''.join(g)
 
         try:
             from graphviz import Source
@@ -417,60 +754,91 @@ class Btree:
         Important, the user supplied "value" is the right value of the operation. That is why the operation are reversed below.
         The left value of the op is the btree value.
         '''
+        results = self._find_in_tree(operator, value)
+        # inserts still waiting in the buffer are part of the result as well
+        # (== returns a single ptr, as the tree does, so the buffer is only searched if the tree has none)
+        if self._buffer_values and not (operator == '==' and results):
+            results = results + self._find_in_buffer(operator, value)
+        return results
+
+    def _find_in_tree(self, operator, value):
+        '''
+        Same as find, without the pending inserts of the buffer.
+        '''
+        if operator in self._RANGE_OPS and self.leaf_values is not None:
+            return self._find_in_leaf_chain(operator, value)
+
         results = []
+        if self.root is None:
+            print('With BTree -> 0 comparison operations')
+            return results
+
         # find the index of the node that the element should exist in
         leaf_idx, ops = self._search(value, True)
         target_node = self.nodes[leaf_idx]
 
         if operator == '==':
-            # if the element exist, append to list, else pass and return
-            try:
-                results.append(target_node.ptrs[target_node.values.index(value)])
-                # print('Found')
-            except:
-                # print('Not found')
-                pass
-
-        # for all other ops, the code is the same, only the operations themselves and the sibling indexes change
+            # binary search for the element in the leaf. if it exists, append to list, else pass and return
+            values = target_node.values
+            idx = bisect_left(values, value)
+            ops += len(values).bit_length()
+            if idx < len(values) and values[idx] == value:
+                results.append(target_node.ptrs[idx])
+
+        # for all other ops, the code is the same, only the binary search and the sibling indexes change
+        # (looked up in _RANGE_OPS instead of a separate branch per operator)
         # for > and >= (btree value is >/>= of user supplied value), we return all the right siblings (all values are larger than current cell)
         # for < and <= (btree value is </<= of user supplied value), we return all the left siblings (all values are smaller than current cell)
-
-        if operator == '>':
-            for idx, node_value in enumerate(target_node.values):
-                ops += 1
-                if node_value > value:
-                    results.append(target_node.ptrs[idx])
-            while target_node.right_sibling is not None:
-                target_node = self.nodes[target_node.right_sibling]
-                results.extend(target_node.ptrs)
-
-        if operator == '>=':
-            for idx, node_value in enumerate(target_node.values):
-                ops += 1
-                if node_value >= value:
-                    results.append(target_node.ptrs[idx])
-            while target_node.right_sibling is not None:
-                target_node = self.nodes[target_node.right_sibling]
+        elif operator in self._RANGE_OPS:
+            sibling = self._RANGE_OPS[operator][0]
+            results = self._slice_range(operator, target_node.values, target_node.ptrs, value).tolist()
+            ops += len(target_node.values).bit_length()
+            sibling_idx = getattr(target_node, sibling)
+            while sibling_idx is not None:
+                target_node = self.nodes[sibling_idx]
                 results.extend(target_node.ptrs)
+                sibling_idx = getattr(target_node, sibling)
 
-        if operator == '<':
-            for idx, node_value in enumerate(target_node.values):
-                ops += 1
-                if node_value < value:
-                    results.append(target_node.ptrs[idx])
-            while target_node.left_sibling is not None:
-                target_node = self.nodes[target_node.left_sibling]
-                results.extend(target_node.ptrs)
+        # print the number of operations (usefull for benchamrking)
+        print(f'With BTree -> {ops} comparison operations')
+        return results
 
-        if operator == '<=':
-            for idx, node_value in enumerate(target_node.values):
-                ops += 1
-                if node_value <= value:
-                    results.append(target_node.ptrs[idx])
-            while target_node.left_sibling is not None:
-                target_node = self.nodes[target_node.left_sibling]
-                results.extend(target_node.ptrs)
+    def _find_in_leaf_chain(self, operator, value):
+        '''
+        Same as find for the >, >=, < and <= operators, using the flat leaf lists (see _build_leaf_chain).
+        A single binary search finds where the matching values start (> and >=) or end (< and <=).
+        '''
+        # a binary search over n values needs at most n.bit_length() comparisons
+        ops = len(self.leaf_values).bit_length()
+        results = self._slice_range(operator, self.leaf_values, self.leaf_ptrs, value).tolist()
 
         # print the number of operations (usefull for benchamrking)
         print(f'With BTree -> {ops} comparison operations')
         return results
+
+    def _find_in_buffer(self, operator, value):
+        '''
+        Return the ptrs of the pending inserts of the buffer where buffer_value"operator"value.
+        '''
+        values = self._buffer_values
+        if operator == '==':
+            idx = bisect_left(values, value)
+            return [self._buffer_ptrs[idx]] if idx < len(values) and values[idx] == value else []
+        if operator in self._RANGE_OPS:
+            return self._slice_range(operator, values, self._buffer_ptrs, value)
+        return []
+
+    def _slice_range(self, operator, values, ptrs, value):
+        '''
+        Return the ptrs of the sorted values where values[i]"operator"value, for the >, >=, < and <= operators.
+        The matches of every range operator are a contiguous run at one end of the values, so a single binary search
+        (bisect_left or bisect_right) finds where they start (> and >=) or end (< and <=) and the ptrs are sliced there.
+        Used for the leaf a find ends in, the flat leaf lists and the insert buffer alike.
+
+        values: sorted values
+        ptrs: the ptr of each value
+        '''
+        sibling, search = self._RANGE_OPS[operator]
+        if sibling == 'right_sibling':
+            return ptrs[search(values, value):]
+        return ptrs[:search(values, value)]
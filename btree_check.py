@@ -0,0 +1,156 @@
+from btree import Btree, Node
+from random import Random
+from contextlib import redirect_stdout
+import io
+import pickle
+'''
+Deterministic check of the Btree against a linear scan.
+For an odd and an even b: insert, find, delete down to empty, and the same again on a bulk loaded + compacted tree,
+on a buffered tree and on pickled/unpickled trees (saved indexes).
+Run: python btree_check.py
+'''
+
+NUM = 300
+BS = [3, 4]
+OPS = {'==': lambda a, b: a == b,
+       '>': lambda a, b: a > b,
+       '>=': lambda a, b: a >= b,
+       '<': lambda a, b: a < b,
+       '<=': lambda a, b: a <= b}
+
+
+def check_find(bt, items, msg):
+    '''
+    Compare find for every operator against a linear scan over the (value, ptr) pairs still in the tree.
+    '''
+    probes = [v for v, _ in items[::7]] + [-1, NUM * 10, NUM * 10 + 1]
+    for value in probes:
+        for op, cmp in OPS.items():
+            # find prints the number of comparisons, keep the output clean
+            with redirect_stdout(io.StringIO()):
+                got = bt.find(op, value)
+            expected = [ptr for v, ptr in items if cmp(v, value)]
+            assert sorted(got) == sorted(expected), f'{msg}: find({op!r}, {value}) returned {sorted(got)}, expected {sorted(expected)}'
+
+
+def check_empty(bt, msg):
+    for op in OPS:
+        with redirect_stdout(io.StringIO()):
+            got = bt.find(op, 0)
+        assert got == [], f'{msg}: find({op!r}, 0) on an empty tree returned {got}'
+
+
+def delete_all(bt, items, rng, msg):
+    '''
+    Delete the items in random order, checking find after every few deletes.
+    '''
+    items = list(items)
+    rng.shuffle(items)
+    while items:
+        value, ptr = items.pop()
+        bt.delete(value, ptr)
+        if len(items) % 10 == 0:
+            check_find(bt, items, f'{msg}, {len(items)} left')
+    check_empty(bt, msg)
+
+
+for b in BS:
+    rng = Random(b)
+    # unique values (== returns a single ptr), spread so that there are gaps to probe
+    values = rng.sample(range(0, NUM * 10, 2), NUM)
+    items = [(value, ptr) for ptr, value in enumerate(values)]
+
+    # one by one inserts (with an even b, every leaf split is a split of an even number of values)
+    bt = Btree(b)
+    check_empty(bt, f'b={b} insert')
+    for i, (value, ptr) in enumerate(items):
+        bt.insert(value, ptr)
+        if i % 25 == 0:
+            check_find(bt, items[:i + 1], f'b={b} insert, {i + 1} in')
+    check_find(bt, items, f'b={b} insert')
+    delete_all(bt, items, rng, f'b={b} delete')
+
+    # the tree has to be usable again after it was emptied
+    for value, ptr in items[:50]:
+        bt.insert(value, ptr)
+    check_find(bt, items[:50], f'b={b} reinsert')
+
+    # bulk load, with a full and a partial fill factor, then compact
+    for fill_factor in (1.0, 0.5):
+        msg = f'b={b} bulk_load({fill_factor})'
+        bt = Btree(b)
+        bt.bulk_load(items, fill_factor=fill_factor)
+        check_find(bt, items, msg)
+        bt.compact()
+        check_find(bt, items, f'{msg} + compact')
+        # inserts after compact drop the flat leaf lists, the tree must still answer correctly
+        extra = [(value + 1, NUM + ptr) for value, ptr in items[:40]]
+        for value, ptr in extra:
+            bt.insert(value, ptr)
+        check_find(bt, items + extra, f'{msg} + compact + insert')
+        bt.compact()
+        check_find(bt, items + extra, f'{msg} + compact + insert + compact')
+        delete_all(bt, items + extra, rng, f'{msg} delete')
+
+    # buffered inserts, with random and ascending values. A buffer of 1 adds every value on its own,
+    # the larger ones are flushed into leaves that end up with several values too many at once
+    for buffer_size in (1, 7, 64):
+        for order, keyed in (('random', items), ('ascending', sorted(items))):
+            msg = f'b={b} buffer_size={buffer_size} {order}'
+            bt = Btree(b, buffer_size=buffer_size)
+            for i, (value, ptr) in enumerate(keyed):
+                bt.insert(value, ptr)
+                if i % 25 == 0:
+                    # the last inserts might still be pending, find has to return them as well
+                    check_find(bt, keyed[:i + 1], f'{msg}, {i + 1} in')
+            check_find(bt, keyed, msg)
+            # delete flushes whatever is pending first
+            delete_all(bt, keyed, rng, f'{msg} delete')
+
+    # == returns a single ptr: the one in the tree if there is one, else the pending one
+    bt = Btree(b, buffer_size=10)
+    for value, ptr in items[:10]:
+        bt.insert(value, ptr)
+    value, ptr = items[0]
+    bt.insert(value, NUM)
+    bt.insert(-5, NUM + 1)
+    with redirect_stdout(io.StringIO()):
+        assert bt.find('==', value) == [ptr], f'b={b} buffer: find(\'==\', {value}) returned {bt.find("==", value)}'
+        assert bt.find('==', -5) == [NUM + 1], f'b={b} buffer: find(\'==\', -5) returned {bt.find("==", -5)}'
+
+    # saved indexes are pickled trees. Round trip a compacted tree, a modified one and one with pending inserts
+    bt = Btree(b, buffer_size=16)
+    bt.bulk_load(items[:200])
+    bt.compact()
+    loaded = pickle.loads(pickle.dumps(bt))
+    assert loaded.leaf_values is not None, f'b={b} pickle: the flat leaf lists were not rebuilt'
+    check_find(loaded, items[:200], f'b={b} pickle compacted')
+    for value, ptr in items[200:]:
+        bt.insert(value, ptr)
+    assert bt._buffer_values, f'b={b} pickle: no pending inserts to pickle'
+    loaded = pickle.loads(pickle.dumps(bt))
+    check_find(loaded, items, f'b={b} pickle modified')
+    delete_all(loaded, items, rng, f'b={b} pickle modified delete')
+
+    # an index pickled by an older version: nodes stored as a dict of attributes with their ptrs in a list,
+    # a tree with only b, nodes and root. Build it the way pickle.load does (__new__ + __setstate__)
+    bt = Btree(b)
+    for value, ptr in items:
+        bt.insert(value, ptr)
+    nodes = []
+    for node in bt.nodes:
+        old = Node.__new__(Node)
+        old.__setstate__({'b': node.b, 'values': list(node.values), 'ptrs': list(node.ptrs),
+                          'left_sibling': node.left_sibling, 'right_sibling': node.right_sibling,
+                          'parent': node.parent, 'is_leaf': node.is_leaf})
+        nodes.append(old)
+    old = Btree.__new__(Btree)
+    old.__setstate__({'b': b, 'nodes': nodes, 'root': bt.root})
+    check_find(old, items, f'b={b} old pickle')
+    extra = [(value + 1, NUM + ptr) for value, ptr in items[:40]]
+    for value, ptr in extra:
+        old.insert(value, ptr)
+    check_find(old, items + extra, f'b={b} old pickle + insert')
+    delete_all(old, items + extra, rng, f'b={b} old pickle delete')
+
+    print(f'b={b} ok')
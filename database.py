@@ -541,9 +541,10 @@ class Database:
         '''
         bt = Btree(3) # 3 is arbitrary
 
-        # for each record in the primary key of the table, insert its value and index to the btree
-        for idx, key in enumerate(self.tables[table_name].column_by_name[self.tables[table_name].pk]):
-            bt.insert(key, idx)
+        # build the btree from the value and index of each record in the primary key of the table
+        # (deleted records are rows of Nones and are not indexed)
+        pk_column = self.tables[table_name].column_by_name(self.tables[table_name].pk)
+        bt.bulk_load((key, idx) for idx, key in enumerate(pk_column) if key is not None)
         # save the btree
         self._save_index(index_name, bt)
 